@@ -1,85 +1,80 @@
-from flask import Flask, request, jsonify
-from flask_cors import CORS
-from flask_socketio import SocketIO, emit
-import threading
-import json
+from quart import Quart
+from quart_cors import cors
+import socketio
+import logging
 import os
-from collections import defaultdict
+import time
 from datetime import datetime
-
-app = Flask(__name__)
-CORS(app, resources={r"/*": {"origins": "*"}})
-socketio = SocketIO(app, cors_allowed_origins="*", async_mode='threading')
-
-current_command = None
-block_database_file = "blocks.json"
-commands = defaultdict(list)  # Warteschlange pro Turtle Label
-turtle_status = {}
-known_blocks = {}
-connected_clients = {}  # WebSocket connections
-
-def load_blocks():
-    global known_blocks
-    if os.path.exists(block_database_file):
-        with open(block_database_file, "r") as f:
-            try:
-                data = json.load(f)
-                for block in data:
-                    key = f"{block['x']},{block['y']},{block['z']}"
-                    known_blocks[key] = block
-                print(f"[INIT] {len(known_blocks)} Bloecke geladen.")
-            except Exception as e:
-                print("[FEHLER] Konnte blocks.json nicht laden:", e)
-
-def save_blocks():
-    with open(block_database_file, "w") as f:
-        json.dump(list(known_blocks.values()), f, indent=2)
+from turtle_core import (
+    VIEWER_ROOM, broadcast_status, commands, compress_bulk_responses, json_response, log,
+    register_routes, turtle_room, turtle_status, update_status,
+)
+
+app = Quart(__name__)
+app = cors(app, allow_origin="*")
+# Optional Redis als Message Queue (z.B. redis://redis:6379/0), damit mehrere Prozesse
+# Rooms und Emits teilen. Ohne Variable bleibt alles im Prozess.
+message_queue = os.environ.get('SOCKETIO_MESSAGE_QUEUE')
+client_manager = socketio.AsyncRedisManager(message_queue) if message_queue else None
+sio = socketio.AsyncServer(async_mode='asgi', cors_allowed_origins="*", client_manager=client_manager)
+register_routes(app, sio)
+asgi_app = socketio.ASGIApp(sio, compress_bulk_responses(app))
+
+connected_clients = {}  # WebSocket connections, connected_at als time.time()
 
 # ============ WebSocket Events ============
 
-@socketio.on('connect')
-def handle_connect():
-    print(f"[WEBSOCKET] Client verbunden: {request.sid}")
-    connected_clients[request.sid] = {
-        'connected_at': datetime.now().isoformat(),
+@sio.on('connect')
+async def handle_connect(sid, environ):
+    log.debug("[WEBSOCKET] Client verbunden: %s", sid)
+    connected_clients[sid] = {
+        'connected_at': time.time(),
         'type': 'unknown'
     }
 
-@socketio.on('disconnect')
-def handle_disconnect():
-    print(f"[WEBSOCKET] Client getrennt: {request.sid}")
-    if request.sid in connected_clients:
-        del connected_clients[request.sid]
+@sio.on('disconnect')
+async def handle_disconnect(sid):
+    log.debug("[WEBSOCKET] Client getrennt: %s", sid)
+    if sid in connected_clients:
+        del connected_clients[sid]
 
-@socketio.on('register')
-def handle_register(data):
+@sio.on('register')
+async def handle_register(sid, data):
     """Register a client (Unity or Turtle)"""
     client_type = data.get('type', 'unknown')
     client_id = data.get('id', 'unknown')
-    connected_clients[request.sid] = {
+    connected_clients[sid] = {
         'type': client_type,
         'id': client_id,
-        'connected_at': datetime.now().isoformat()
+        'connected_at': time.time()
     }
-    print(f"[WEBSOCKET] Client registriert: {client_type} - {client_id}")
-    emit('registered', {'status': 'ok', 'sid': request.sid})
-
-@socketio.on('turtle_status')
-def handle_turtle_status(data):
+    await sio.enter_room(sid, VIEWER_ROOM if client_type == 'unity' else turtle_room(client_id))
+    log.info("[WEBSOCKET] Client registriert: %s - %s", client_type, client_id)
+    # sid haengt an diesem Prozess, daher ohne Umweg ueber die Message Queue
+    await sio.emit('registered', {'status': 'ok', 'sid': sid}, to=sid, ignore_queue=True)
+    if client_type == 'unity':
+        # Neue Viewer bekommen sofort den vollen Stand, danach nur noch Deltas.
+        # emit() gibt den Event-Loop frei: Kopien, damit neue Turtles/Updates nicht dazwischenfunken
+        for status in list(turtle_status.values()):
+            await sio.emit('status_update', dict(status), to=sid, ignore_queue=True)
+
+@sio.on('turtle_status')
+async def handle_turtle_status(sid, data):
     """Receive real-time turtle status updates via WebSocket"""
     if not data or 'label' not in data:
         return
 
     label = data['label']
-    turtle_status[label] = data
+    delta = update_status(label, data)
 
     # Broadcast to all Unity clients
-    socketio.emit('status_update', data, broadcast=True)
+    await broadcast_status(sio, label, delta)
 
-    print(f"[WS STATUS] {label} @ {data.get('position')} | Fuel: {data.get('fuelLevel')} | Inv: {data.get('inventorySlotsUsed')}/16")
+    if log.isEnabledFor(logging.DEBUG):
+        log.debug("[WS STATUS] %s @ %s | Fuel: %s | Inv: %s/16", label, data.get('position'), data.get('fuelLevel'), data.get('inventorySlotsUsed'))
 
-@socketio.on('command')
-def handle_command(data):
+@sio.on('command')
+async def handle_command(sid, data):
     """Send command to specific turtle via WebSocket"""
     label = data.get('label')
     command = data.get('command')
@@ -87,120 +82,23 @@ def handle_command(data):
     if label and command:
         commands[label].append(command)
         # Notify turtle immediately
-        socketio.emit(f'command_{label}', {'command': command})
-        print(f"[WS COMMAND] Sende '{command}' an {label}")
+        await sio.emit('command', {'commands': [command]}, to=turtle_room(label), skip_sid=sid)
+        log.debug("[WS COMMAND] Sende '%s' an %s", command, label)
         return {'status': 'ok'}
     return {'status': 'error', 'message': 'Label oder Command fehlt'}
 
-# ============ REST API (Backwards Compatibility) ============
-
-@app.route('/')
-def index():
-    return "Turtle Command Server mit WebSocket laeuft!"
-
-@app.route('/command', methods=['POST'])
-def set_command():
-    global current_command
-    data = request.get_json()
-    if not data:
-        return jsonify({'status': 'error', 'message': 'Keine Daten erhalten'}), 400
-
-    current_command = data
-    print(f"[INFO] Neuer Befehl empfangen: {data}")
-    return jsonify({'status': 'ok', 'message': 'Befehl gespeichert'}), 200
-
-@app.route("/commands", methods=["POST"])
-def queue_commands():
-    data = request.json
-    label = data.get("label")
-    cmds = data.get("commands", [])
-    if label:
-        commands[label].extend(cmds)
-        # Notify via WebSocket
-        socketio.emit(f'commands_{label}', {'commands': cmds})
-        print(f"[QUEUE] Für Turtle '{label}' {len(cmds)} Kommandos hinzugefügt. Gesamt in Queue: {len(commands[label])}")
-        return jsonify({'status': 'ok', 'message': 'Kommandos gequeued'}), 200
-    return jsonify({'status': 'error', 'message': 'Kein Label angegeben'}), 400
-
-@app.route("/commands", methods=["GET"])
-def get_all_commands():
-    label = request.args.get("label")
-    if label and label in commands:
-        return jsonify({"commands": commands[label]})
-    return jsonify({"commands": []})
-
-@app.route("/command", methods=["GET"])
-def get_next_command():
-    label = request.args.get("label")
-    if label and label in commands and commands[label]:
-        next_cmd = commands[label].pop(0)
-        print(f"[COMMAND] Turtle '{label}' bekommt Kommando: {next_cmd}")
-        return jsonify({"command": next_cmd})
-    return jsonify({"command": None})
-
-@app.route('/status', methods=['POST'])
-def receive_status():
-    data = request.get_json()
-    if not data or 'label' not in data:
-        return jsonify({'status': 'error', 'message': 'Ungueltiger Status'}), 400
-
-    label = data['label']
-    turtle_status[label] = data
-
-    # Broadcast via WebSocket
-    socketio.emit('status_update', data)
-
-    print(f"[STATUS] {label} @ {data.get('position')} | Richtung: {data.get('direction')} | Busy: {data.get('isBusy')} | Fuel: {data.get('fuelLevel')}/{data.get('maxFuel')}")
-    print(f"        Inventory Slots benutzt: {data.get('inventorySlotsUsed')}/{data.get('inventorySlotsTotal')}")
-    return jsonify({'status': 'ok'}), 200
-
-@app.route('/status/<label>', methods=['GET'])
-def get_status(label):
-    status = turtle_status.get(label)
-    if status:
-        return jsonify(status)
-    else:
-        return jsonify({'status': 'error', 'message': 'Nicht gefunden'}), 404
-
-@app.route('/status/all', methods=['GET'])
-def get_all_status():
-    return jsonify(list(turtle_status.values()))
-
-@app.route('/report', methods=['POST'])
-def receive_scan():
-    global known_blocks
-    data = request.get_json(force=True)
-    if isinstance(data, list):
-        new_blocks = 0
-        for block in data:
-            key = f"{block['x']},{block['y']},{block['z']}"
-            if key not in known_blocks:
-                known_blocks[key] = block
-                new_blocks += 1
-
-        if new_blocks > 0:
-            save_blocks()
-            # Broadcast new blocks via WebSocket
-            socketio.emit('blocks_update', {'new_blocks': new_blocks, 'total': len(known_blocks)})
-            print(f"[SCAN] {new_blocks} neue Bloecke gespeichert. Gesamt: {len(known_blocks)}")
-        else:
-            print("[SCAN] Keine neuen Bloecke.")
-
-        return jsonify({"status": "ok", "new_blocks": new_blocks})
-    else:
-        return jsonify({"status": "error", "message": "Ungueltige Daten"}), 400
-
-@app.route('/report', methods=['GET'])
-def get_scan():
-    return jsonify(list(known_blocks.values()))
+# ============ REST API (Backwards Compatibility, siehe turtle_core.register_routes) ============
 
 @app.route('/ws/clients', methods=['GET'])
-def get_connected_clients():
+async def get_connected_clients():
     """Debug endpoint to see connected WebSocket clients"""
-    return jsonify(connected_clients)
+    return json_response({
+        sid: {**client, 'connected_at': datetime.fromtimestamp(client['connected_at']).isoformat()}
+        for sid, client in connected_clients.items()
+    })
 
 if __name__ == '__main__':
-    load_blocks()
-    print("[INIT] Starte Server mit WebSocket Support auf Port 4999")
-    print("[INIT] WebSocket Endpoint: ws://0.0.0.0:4999/socket.io/")
-    socketio.run(app, host='0.0.0.0', port=4999, debug=True, allow_unsafe_werkzeug=True)
+    import uvicorn
+    log.info("[INIT] Starte Server mit WebSocket Support auf Port 4999")
+    log.info("[INIT] WebSocket Endpoint: ws://0.0.0.0:4999/socket.io/")
+    uvicorn.run(asgi_app, host='0.0.0.0', port=4999)
@@ -0,0 +1,351 @@
+from quart import Response, request
+from starlette.middleware.gzip import GZipMiddleware
+import asyncio
+import json
+import logging
+import os
+import sqlite3
+import time
+import orjson
+from collections import defaultdict, deque
+from operator import itemgetter
+
+logging.basicConfig(format="%(asctime)s %(message)s")
+log = logging.getLogger('turtle')
+try:
+    log.setLevel(os.environ.get('LOG_LEVEL', 'INFO').upper())
+except ValueError:
+    log.setLevel(logging.INFO)
+    log.warning("[INIT] Unbekanntes LOG_LEVEL %r, verwende INFO", os.environ['LOG_LEVEL'])
+
+current_command = None
+block_database_file = "blocks.db"
+legacy_block_file = "blocks.json"  # Altes Format, wird beim ersten Start nach SQLite uebernommen
+# commands/turtle_status werden nur im Event-Loop-Thread angefasst (zwischen zwei
+# awaits atomar), der Executor-Thread von ingest_blocks() sieht nur SQLite -> kein Lock noetig
+commands = defaultdict(deque)  # Warteschlange pro Turtle Label
+turtle_status = {}
+known_blocks = {}  # (x, y, z) -> block
+block_list = []  # Dieselben Bloecke in Einfuegereihenfolge; nur angehaengt, nie veraendert
+CHUNK_SIZE = 16
+chunks = defaultdict(dict)  # Raeumlicher Index: (x // CHUNK_SIZE, z // CHUNK_SIZE) -> {(x, y, z): block}
+MAX_NEAR_RADIUS = 400  # Obergrenze fuer r bei GET /report/near, die Suche laeuft auf dem Event-Loop
+STREAM_BATCH = 1024  # Bloecke pro gesendetem Chunk bei GET /report
+INGEST_QUEUE_SIZE = 4096  # Max. wartende /report-Pakete, danach blockiert POST /report (Backpressure)
+INGEST_BATCH = 200  # Max. /report-Pakete, die in einer Transaktion zusammengefasst werden
+INGEST_WINDOW = 0.05  # Sekunden, die nach dem ersten Paket auf weitere gewartet wird
+db = None
+ingest_q = None  # asyncio.Queue mit Blocklisten aus /report POST, einziger Leser ist ingest_blocks()
+_unsaved_blocks = []  # Neue Bloecke, deren Speichern in SQLite fehlgeschlagen ist
+_ingest_task = None
+_STOP_INGEST = object()  # Sentinel: ingest_blocks() arbeitet die Queue ab und beendet sich
+VIEWER_ROOM = 'viewers'  # Unity-Clients; Turtles landen in turtle_room(label)
+STATUS_RESYNC_INTERVAL = 10.0  # Sekunden, nach denen pro Turtle wieder der volle Status gesendet wird
+_last_full = {}  # label -> time.monotonic() des letzten vollen Status
+# Nur die grossen JSON-Listen gzip-komprimieren: Quart sendet jede Antwort gestreamt,
+# daher greift minimum_size der Middleware nicht und kleine Antworten wuerden mitkomprimiert
+COMPRESSED_PATHS = {'/report', '/report/near', '/status/all'}
+
+def json_response(payload):
+    try:
+        body = orjson.dumps(payload)
+    except orjson.JSONEncodeError:
+        # z.B. Ganzzahlen ausserhalb von 64 Bit aus /status oder /commands, die stdlib kann das
+        body = json.dumps(payload)
+    return Response(body, mimetype='application/json')
+
+def compress_bulk_responses(app):
+    """Wrap app so that GET requests to COMPRESSED_PATHS are gzip-compressed"""
+    gzip_app = GZipMiddleware(app, compresslevel=4)
+
+    async def http_app(scope, receive, send):
+        if scope['type'] == 'http' and scope['method'] == 'GET' and scope['path'] in COMPRESSED_PATHS:
+            await gzip_app(scope, receive, send)
+        else:
+            await app(scope, receive, send)
+
+    return http_app
+
+def open_db():
+    global db
+    # ingest_blocks() schreibt aus einem Executor-Thread, immer nur einer gleichzeitig
+    db = sqlite3.connect(block_database_file, check_same_thread=False)
+    db.execute("PRAGMA journal_mode=WAL")
+    db.execute("PRAGMA synchronous=NORMAL")
+    db.execute("CREATE TABLE IF NOT EXISTS blocks (x INT, y INT, z INT, data TEXT, PRIMARY KEY(x, y, z)) WITHOUT ROWID")
+    db.execute("CREATE INDEX IF NOT EXISTS idx_xz ON blocks(x, z)")
+
+block_key = itemgetter('x', 'y', 'z')
+MAX_COORD = 2 ** 63 - 1  # SQLite INTEGER
+
+def valid_block(block):
+    """True for a dict whose x/y/z are ints that fit into an SQLite INTEGER.
+
+    Integral floats (e.g. 12.0 from Lua clients) are converted to int in place.
+    """
+    if not isinstance(block, dict):
+        return False
+    for c in ('x', 'y', 'z'):
+        v = block.get(c)
+        if type(v) is float and v.is_integer():
+            v = block[c] = int(v)
+        if type(v) is not int or not -MAX_COORD <= v <= MAX_COORD:
+            return False
+    return True
+
+def add_block(key, block):
+    known_blocks[key] = block
+    block_list.append(block)
+    chunks[(block['x'] // CHUNK_SIZE, block['z'] // CHUNK_SIZE)][key] = block
+
+def load_blocks():
+    open_db()
+    try:
+        for x, y, z, data in db.execute("SELECT x, y, z, data FROM blocks"):
+            key = (x, y, z)
+            block = orjson.loads(data)
+            add_block(key, block)
+    except Exception as e:
+        log.error("[FEHLER] Konnte blocks.db nicht laden: %s", e)
+
+    if not known_blocks and os.path.exists(legacy_block_file):
+        with open(legacy_block_file, "rb") as f:
+            try:
+                data = orjson.loads(f.read())
+                for block in data:
+                    key = block_key(block)
+                    add_block(key, block)
+                save_blocks(block_list)
+                log.info("[INIT] %d Bloecke aus blocks.json nach blocks.db uebernommen.", len(known_blocks))
+            except Exception as e:
+                log.error("[FEHLER] Konnte blocks.json nicht laden: %s", e)
+    log.info("[INIT] %d Bloecke geladen.", len(known_blocks))
+
+def save_blocks(blocks):
+    rows = [(*block_key(block), orjson.dumps(block)) for block in blocks]
+    with db:
+        db.executemany("INSERT OR IGNORE INTO blocks VALUES (?, ?, ?, ?)", rows)
+
+def merge_blocks(batch):
+    """Merge queued scans into known_blocks and return the blocks that were new"""
+    new_blocks = []
+    for blocks in batch:
+        for block in blocks:
+            # Bloecke sind bereits in receive_scan() geprueft
+            key = block_key(block)
+            if key not in known_blocks:
+                add_block(key, block)
+                new_blocks.append(block)
+    return new_blocks
+
+async def ingest_blocks(sio=None):
+    """Single writer for known_blocks: merge queued scans and persist them in one transaction"""
+    global _unsaved_blocks
+    loop = asyncio.get_running_loop()
+    stopping = False
+    while not stopping:
+        batch = [await ingest_q.get()]
+        await asyncio.sleep(INGEST_WINDOW)
+        while len(batch) < INGEST_BATCH and not ingest_q.empty():
+            batch.append(ingest_q.get_nowait())
+        if batch[-1] is _STOP_INGEST:
+            stopping = True
+            batch.pop()
+
+        # Ein kaputtes Paket darf den einzigen Writer nicht beenden
+        try:
+            new_blocks = merge_blocks(batch)
+            if not new_blocks and not _unsaved_blocks:
+                log.debug("[SCAN] Keine neuen Bloecke.")
+                continue
+
+            to_save, _unsaved_blocks = _unsaved_blocks + new_blocks, []
+            try:
+                await loop.run_in_executor(None, save_blocks, to_save)
+            except sqlite3.Error as e:
+                log.error("[FEHLER] Konnte Bloecke nicht speichern: %s", e)
+                _unsaved_blocks = to_save
+
+            if new_blocks:
+                if sio:
+                    # Broadcast new blocks via WebSocket
+                    await sio.emit('blocks_update', {'new_blocks': len(new_blocks), 'total': len(known_blocks)}, to=VIEWER_ROOM)
+                log.debug("[SCAN] %d neue Bloecke aus %d Scans. Gesamt: %d", len(new_blocks), len(batch), len(known_blocks))
+        except Exception:
+            log.exception("[FEHLER] Scan-Batch konnte nicht verarbeitet werden")
+
+def turtle_room(label):
+    return f'turtle:{label}'
+
+def update_status(label, data, track_delta=True):
+    """Merge data into the turtle's status dict in place; return the changed fields if track_delta"""
+    slot = turtle_status.setdefault(label, {})
+    if not track_delta:
+        slot.update(data)
+        return None
+    delta = {k: v for k, v in data.items() if k not in slot or slot[k] != v}
+    slot.update(delta)
+    return delta
+
+async def broadcast_status(sio, label, delta):
+    """Send viewers the changed status fields (plus label), or the full status every STATUS_RESYNC_INTERVAL"""
+    now = time.monotonic()
+    last_full = _last_full.get(label)
+    if last_full is None or now - last_full >= STATUS_RESYNC_INTERVAL:
+        _last_full[label] = now
+        await sio.emit('status_update', dict(turtle_status[label]), to=VIEWER_ROOM)
+    elif delta:
+        delta['label'] = label
+        await sio.emit('status_update', delta, to=VIEWER_ROOM)
+
+def register_routes(app, sio=None):
+    """Register the REST API and block storage lifecycle on app; WebSocket emits only when sio is given"""
+
+    @app.before_serving
+    async def startup():
+        global ingest_q, _ingest_task
+        load_blocks()
+        ingest_q = asyncio.Queue(maxsize=INGEST_QUEUE_SIZE)
+        _ingest_task = asyncio.create_task(ingest_blocks(sio))
+
+    @app.after_serving
+    async def shutdown():
+        await ingest_q.put(_STOP_INGEST)
+        await _ingest_task
+        db.close()
+
+    @app.route('/')
+    async def index():
+        if sio:
+            return "Turtle Command Server mit WebSocket laeuft!"
+        return "Turtle Command Server laeuft!"
+
+    @app.route('/command', methods=['POST'])
+    async def set_command():
+        global current_command
+        data = await request.get_json()
+        if not data:
+            return json_response({'status': 'error', 'message': 'Keine Daten erhalten'}), 400
+
+        current_command = data
+        log.info("[INFO] Neuer Befehl empfangen: %s", data)
+        return json_response({'status': 'ok', 'message': 'Befehl gespeichert'}), 200
+
+    @app.route("/commands", methods=["POST"])
+    async def queue_commands():
+        data = await request.get_json()
+        label = data.get("label")
+        cmds = data.get("commands", [])
+        if label:
+            queue = commands[label]
+            queue.extend(cmds)
+            if sio:
+                # Notify via WebSocket
+                await sio.emit('command', {'commands': cmds}, to=turtle_room(label))
+            log.debug("[QUEUE] Für Turtle '%s' %d Kommandos hinzugefügt. Gesamt in Queue: %d", label, len(cmds), len(queue))
+            return json_response({'status': 'ok', 'message': 'Kommandos gequeued'}), 200
+        return json_response({'status': 'error', 'message': 'Kein Label angegeben'}), 400
+
+    @app.route("/commands", methods=["GET"])
+    async def get_all_commands():
+        label = request.args.get("label")
+        queue = commands.get(label)
+        if queue:
+            return json_response({"commands": list(queue)})
+        return json_response({"commands": []})
+
+    @app.route("/command", methods=["GET"])
+    async def get_next_command():
+        label = request.args.get("label")
+        queue = commands.get(label)
+        if queue:
+            next_cmd = queue.popleft()
+            log.debug("[COMMAND] Turtle '%s' bekommt Kommando: %s", label, next_cmd)
+            return json_response({"command": next_cmd})
+        return json_response({"command": None})
+
+    @app.route('/status', methods=['POST'])
+    async def receive_status():
+        data = await request.get_json()
+        if not data or 'label' not in data:
+            return json_response({'status': 'error', 'message': 'Ungueltiger Status'}), 400
+
+        label = data['label']
+        delta = update_status(label, data, track_delta=sio is not None)
+
+        if sio:
+            # Broadcast via WebSocket
+            await broadcast_status(sio, label, delta)
+
+        if log.isEnabledFor(logging.DEBUG):
+            log.debug("[STATUS] %s @ %s | Richtung: %s | Busy: %s | Fuel: %s/%s | Inventory Slots benutzt: %s/%s | Ausgerüstetes Links: %s | Ausgerüstetes Rechts: %s",
+                      label, data.get('position'), data.get('direction'), data.get('isBusy'), data.get('fuelLevel'), data.get('maxFuel'),
+                      data.get('inventorySlotsUsed'), data.get('inventorySlotsTotal'), data.get('equippedToolLeft'), data.get('equippedToolRight'))
+        return json_response({'status': 'ok'}), 200
+
+    @app.route('/status/<label>', methods=['GET'])
+    async def get_status(label):
+        status = turtle_status.get(label)
+        if status:
+            return json_response(status)
+        else:
+            return json_response({'status': 'error', 'message': 'Nicht gefunden'}), 404
+
+    @app.route('/status/all', methods=['GET'])
+    async def get_all_status():
+        return json_response(list(turtle_status.values()))
+
+    @app.route('/report', methods=['POST'])
+    async def receive_scan():
+        raw = await request.get_data(cache=False)
+        try:
+            data = orjson.loads(raw) if raw else None
+        except orjson.JSONDecodeError:
+            data = None
+        if not isinstance(data, list):
+            return json_response({"status": "error", "message": "Ungueltige Daten"}), 400
+        blocks = [block for block in data if valid_block(block)]
+        dropped = len(data) - len(blocks)
+        if dropped and not blocks:
+            return json_response({"status": "error", "message": "Ungueltige Daten", "dropped": dropped}), 400
+        if blocks:
+            # Zusammenfuehren und Speichern uebernimmt ingest_blocks()
+            await ingest_q.put(blocks)
+        return json_response({"status": "accepted", "queued": len(blocks), "dropped": dropped}), 202
+
+    @app.route('/report', methods=['GET'])
+    async def get_scan():
+        # block_list wird nur verlaengert: die Laenge jetzt ist ein stabiler Snapshot,
+        # auch wenn ingest_blocks() zwischen zwei Chunks neue Bloecke anhaengt
+        count = len(block_list)
+
+        async def generate():
+            yield b'['
+            for i in range(0, count, STREAM_BATCH):
+                chunk = orjson.dumps(block_list[i:min(i + STREAM_BATCH, count)])[1:-1]
+                yield chunk if i == 0 else b',' + chunk
+            yield b']'
+
+        return Response(generate(), mimetype='application/json')
+
+    @app.route('/report/near', methods=['GET'])
+    async def get_scan_near():
+        """Blocks within r (x/z, all heights) of a position, read from the chunk index"""
+        x = request.args.get("x", type=int)
+        z = request.args.get("z", type=int)
+        r = request.args.get("r", type=int) if "r" in request.args else CHUNK_SIZE
+        if x is None or z is None or r is None or r < 0:
+            return json_response({'status': 'error', 'message': 'x, z und r muessen Ganzzahlen sein'}), 400
+        if r > MAX_NEAR_RADIUS:
+            return json_response({'status': 'error', 'message': f'r darf hoechstens {MAX_NEAR_RADIUS} sein'}), 400
+
+        result = []
+        for cx in range((x - r) // CHUNK_SIZE, (x + r) // CHUNK_SIZE + 1):
+            for cz in range((z - r) // CHUNK_SIZE, (z + r) // CHUNK_SIZE + 1):
+                bucket = chunks.get((cx, cz))
+                if not bucket:
+                    continue
+                for block in bucket.values():
+                    if abs(block['x'] - x) <= r and abs(block['z'] - z) <= r:
+                        result.append(block)
+        return json_response(result)